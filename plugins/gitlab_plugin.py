@@ -26,21 +26,28 @@ class GitLabPlugin:
 
     @kernel_function(
         name="list_issues",
-        description="List issues for a GitLab project, filter by state=opened/closed/all and search text.")
+        description="List issues for a GitLab project, filter by state=opened/closed/all, search text "
+                    "updated_after (ISO 8601 timestamp) and page.")
     def list_issues(
         self,
         project_path: Optional[str] = None,
         state: str = "opened",
         search: Optional[str] = None,
-        per_page: int = 20
+        per_page: int = 20,
+        updated_after: Optional[str] = None,
+        page: int = 1
     ) -> str:
         project = project_path or self.default_project
         if not project:
             return "ERROR: project_path is required (no default project configured)."
         url = f"{self._project_url(project)}/issues"
-        params = {"state": state, "per_page": per_page}
+        params = {"state": state, "per_page": per_page, "page": page}
         if search:
             params["search"] = search
+        if updated_after:
+            params["updated_after"] = updated_after
+            params["order_by"] = "updated_at"
+            params["sort"] = "asc"
         r = self._session.get(url, params=params, timeout=30)
         if r.status_code != 200:
             return f"ERROR: {r.status_code} {r.text}"
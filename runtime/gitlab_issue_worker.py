@@ -0,0 +1,541 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from plugins.gitlab_plugin import GitLabPlugin
+
+logger = logging.getLogger(__name__)
+
+IssueKey = Tuple[str, int]  # (project_path, issue_iid)
+
+
+async def _run_scrum_team(task: str) -> str:
+    # Imported lazily so the worker can be driven by another runner (e.g. in tests).
+    from runtime.run_scrum_team import run_scrum_team
+    return await run_scrum_team(task)
+
+
+def _parse_ts(value: str) -> datetime:
+    # The REST API returns e.g. "2024-01-31T12:00:00.000Z", webhooks often "2024-01-31 12:00:00 UTC".
+    return datetime.fromisoformat(value.replace(" UTC", "+00:00").replace("Z", "+00:00"))
+
+
+def _timestamp(value: Optional[str]) -> Optional[float]:
+    try:
+        return _parse_ts(value).timestamp() if value else None
+    except (TypeError, ValueError):
+        logger.warning("Unparseable GitLab timestamp %r", value)
+        return None
+
+
+# -----------------------------
+# Issue event model
+# -----------------------------
+@dataclass
+class IssueEvent:
+    project_path: str
+    issue_iid: int
+    title: str
+    description: str
+    labels: List[str] = field(default_factory=list)
+    updated_at: str = ""
+    # Wall-clock time of the oldest edit in a coalesced batch (updated_at, else
+    # receipt time); end-to-end lag is measured from here until results are posted.
+    lag_origin: Optional[float] = None
+    # Start of the max-delay window; unlike lag_origin it resets when a run
+    # is dispatched or cancelled, so a stale run does not disable debouncing.
+    window_start: float = field(default_factory=time.monotonic)
+
+    def __post_init__(self):
+        if self.lag_origin is None:
+            self.lag_origin = _timestamp(self.updated_at) or time.time()
+
+    @property
+    def key(self) -> IssueKey:
+        return (self.project_path, self.issue_iid)
+
+    @property
+    def digest(self) -> str:
+        return hashlib.sha256(f"{self.title}\n{self.description}".encode("utf-8")).hexdigest()
+
+    def to_task(self) -> str:
+        return f"{self.title}\n\n{self.description}".strip()
+
+
+# -----------------------------
+# Ingestion worker
+# -----------------------------
+class GitLabIssueWorker:
+    """
+    Runs the Scrum team for new or edited GitLab requirement issues
+    (issues carrying trigger_label).
+
+    Events arrive from webhook payloads (submit_webhook_payload) or from
+    polling list_issues with updated_after (poll_once). Edits are debounced
+    and coalesced per issue, runs made stale by newer edits are cancelled,
+    and results are posted back through create_issue / add_labels_to_issue.
+    """
+
+    def __init__(
+        self,
+        gitlab: GitLabPlugin,
+        project_path: Optional[str] = None,
+        runner: Callable[[str], Awaitable[str]] = _run_scrum_team,
+        debounce_seconds: float = 20.0,
+        max_delay_seconds: float = 120.0,
+        max_concurrent_runs: int = 1,
+        trigger_label: str = "requirement",
+        result_label: str = "scrum-ai-package",
+        processed_label: str = "scrum-ai-processed",
+        updated_after: Optional[str] = None,
+        lag_window: int = 1000,
+        max_attempts: int = 3,
+        retry_backoff_seconds: float = 30.0,
+    ):
+        self.gitlab = gitlab
+        self.project_path = project_path or gitlab.default_project
+        self.runner = runner
+        self.debounce_seconds = debounce_seconds
+        self.max_delay_seconds = max_delay_seconds
+        self.max_concurrent_runs = max_concurrent_runs
+        self.trigger_label = trigger_label
+        self.result_label = result_label
+        self.processed_label = processed_label
+        self.max_attempts = max_attempts
+        self.retry_backoff_seconds = retry_backoff_seconds
+        # Only issues updated after this point are picked up by polling.
+        self.updated_after = updated_after or datetime.now(timezone.utc).isoformat()
+
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._pending: Dict[IssueKey, IssueEvent] = {}
+        self._timers: Dict[IssueKey, asyncio.TimerHandle] = {}
+        self._queued: set = set()
+        self._active: Dict[IssueKey, Tuple[IssueEvent, asyncio.Task]] = {}
+        self._cancellable: set = set()
+        self._last_digest: Dict[IssueKey, str] = {}
+        self._failures: Dict[IssueKey, Tuple[str, int]] = {}  # (digest, failed attempts)
+        self._tasks: List[asyncio.Task] = []
+
+        self._counters = {
+            "events_received": 0,
+            "events_ignored": 0,
+            "events_coalesced": 0,
+            "runs_started": 0,
+            "runs_completed": 0,
+            "runs_cancelled": 0,
+            "runs_failed": 0,
+        }
+        self._lag_seconds: Deque[float] = deque(maxlen=lag_window)
+
+    # ------------------------------------
+    # Event intake
+    # ------------------------------------
+    def submit(self, event: IssueEvent) -> None:
+        """Register an issue edit; must be called on the worker's event loop."""
+        self._counters["events_received"] += 1
+        key = event.key
+
+        if self.result_label in event.labels:
+            # Issues created by this worker must not trigger new runs.
+            self._counters["events_ignored"] += 1
+            return
+        if self.trigger_label not in event.labels:
+            # Only requirement issues run the Scrum team; dropping the label withdraws a pending edit.
+            self._counters["events_ignored"] += 1
+            self._discard(key)
+            return
+        if self._known_digest(key) == event.digest:
+            # Label-only or no-op edits (including our own processed label), or a
+            # re-delivery of the edit that is already pending.
+            self._counters["events_ignored"] += 1
+            return
+
+        previous = self._pending.get(key)
+        if previous is not None:
+            self._counters["events_coalesced"] += 1
+            event.lag_origin = min(event.lag_origin, previous.lag_origin)
+            event.window_start = previous.window_start
+
+        if key in self._cancellable:
+            stale_event, task = self._active[key]
+            event.lag_origin = min(event.lag_origin, stale_event.lag_origin)
+            self._cancellable.discard(key)
+            task.cancel()
+            logger.info("Cancelling stale run for %s#%s", *key)
+
+        self._pending[key] = event
+        self._schedule(key)
+
+    def submit_webhook_payload(self, payload: Dict[str, Any]) -> None:
+        """Accept a GitLab "Issue Hook" payload."""
+        if payload.get("object_kind") != "issue":
+            return
+        attrs = payload.get("object_attributes") or {}
+        project = (payload.get("project") or {}).get("path_with_namespace")
+        if project != self.project_path:
+            # Never run (or write results) for a project other than the configured one.
+            logger.warning("Ignoring issue event for unexpected project %r", project)
+            return
+        try:
+            key = (project, int(attrs["iid"]))
+        except (KeyError, TypeError, ValueError):
+            logger.warning("Ignoring issue event without a valid iid: %r", attrs.get("iid"))
+            return
+
+        if attrs.get("action") == "close" or attrs.get("state") == "closed":
+            self._discard(key)
+            return
+
+        self.submit(IssueEvent(
+            project_path=project,
+            issue_iid=key[1],
+            title=attrs.get("title") or "",
+            description=attrs.get("description") or "",
+            labels=[x.get("title", "") for x in payload.get("labels") or []],
+            updated_at=attrs.get("updated_at") or "",
+        ))
+
+    async def poll_once(self, per_page: int = 100) -> int:
+        """Fetch issues updated since the last poll and submit them. Returns the number fetched."""
+        # All states, so a close seen by polling withdraws a pending edit like the webhook does.
+        # Every page is read so more than per_page issues sharing one updated_at cannot stall the cursor.
+        since = self.updated_after
+        issues: List[Dict[str, Any]] = []
+        page = 1
+        while True:
+            raw = await asyncio.to_thread(
+                self.gitlab.list_issues,
+                project_path=self.project_path,
+                state="all",
+                per_page=per_page,
+                updated_after=since,
+                page=page,
+            )
+            if raw.startswith("ERROR:"):
+                logger.warning("Polling GitLab failed: %s", raw)
+                break
+            batch = json.loads(raw)
+            issues.extend(batch)
+            if len(batch) < per_page:
+                break
+            page += 1
+
+        cursor = _timestamp(since)
+        for issue in issues:
+            event = IssueEvent(
+                project_path=self.project_path,
+                issue_iid=int(issue["iid"]),
+                title=issue.get("title") or "",
+                description=issue.get("description") or "",
+                labels=issue.get("labels") or [],
+                updated_at=issue.get("updated_at") or "",
+            )
+            updated = _timestamp(event.updated_at)
+            latest = _timestamp(self.updated_after)
+            if updated is not None and (latest is None or updated > latest):
+                self.updated_after = event.updated_at
+
+            if issue.get("state") == "closed":
+                self._discard(event.key)
+                continue
+            # updated_after is inclusive, so the issue at the cursor comes back on every poll.
+            if updated is not None and cursor is not None and updated <= cursor \
+                    and self._known_digest(event.key) == event.digest:
+                continue
+            self.submit(event)
+        return len(issues)
+
+    async def poll_forever(self, interval_seconds: float = 30.0) -> None:
+        while True:
+            try:
+                await self.poll_once()
+            except Exception:
+                logger.exception("Polling GitLab failed")
+            await asyncio.sleep(interval_seconds)
+
+    # ------------------------------------
+    # Debounce / coalesce
+    # ------------------------------------
+    def _known_digest(self, key: IssueKey) -> Optional[str]:
+        # Content of the pending edit, else of the last run started for this issue.
+        pending = self._pending.get(key)
+        return pending.digest if pending is not None else self._last_digest.get(key)
+
+    def _schedule(self, key: IssueKey) -> None:
+        handle = self._timers.pop(key, None)
+        if handle is not None:
+            handle.cancel()
+
+        # Keep resetting the quiet period, but never hold a batch longer than max_delay_seconds.
+        waited = time.monotonic() - self._pending[key].window_start
+        delay = max(0.0, min(self.debounce_seconds, self.max_delay_seconds - waited))
+        self._timers[key] = self.loop.call_later(delay, self._on_debounced, key)
+
+    def _on_debounced(self, key: IssueKey) -> None:
+        self._timers.pop(key, None)
+        self._enqueue(key)
+
+    def _enqueue(self, key: IssueKey) -> None:
+        # One run per issue at a time; _finish re-enqueues once the active run is done.
+        if key not in self._pending or key in self._queued or key in self._active:
+            return
+        self._queued.add(key)
+        self._queue.put_nowait(key)
+
+    def _discard(self, key: IssueKey) -> None:
+        self._pending.pop(key, None)
+        handle = self._timers.pop(key, None)
+        if handle is not None:
+            handle.cancel()
+        if key in self._cancellable:
+            self._cancellable.discard(key)
+            self._active[key][1].cancel()
+
+    # ------------------------------------
+    # Execution
+    # ------------------------------------
+    async def _consume(self) -> None:
+        while True:
+            key = await self._queue.get()
+            self._queued.discard(key)
+            event = self._pending.pop(key, None)
+            if event is None:
+                continue
+
+            task = asyncio.create_task(self._run_and_post(event))
+            self._active[key] = (event, task)
+            self._cancellable.add(key)
+            try:
+                await asyncio.wait({task})
+            except asyncio.CancelledError:
+                task.cancel()
+                raise
+            finally:
+                self._finish(key)
+
+            if task.cancelled():
+                self._counters["runs_cancelled"] += 1
+            elif task.exception() is not None:
+                self._counters["runs_failed"] += 1
+                logger.error("Scrum run for %s#%s failed", *key, exc_info=task.exception())
+
+    def _finish(self, key: IssueKey) -> None:
+        self._active.pop(key, None)
+        self._cancellable.discard(key)
+        if key not in self._timers:
+            self._enqueue(key)
+
+    async def _run_and_post(self, event: IssueEvent) -> None:
+        key = event.key
+        self._last_digest[key] = event.digest
+        self._counters["runs_started"] += 1
+        logger.info("Running Scrum team for %s#%s", *key)
+        try:
+            final_output = await self.runner(event.to_task())
+
+            # Past this point a newer edit no longer cancels; it is queued behind the post.
+            self._cancellable.discard(key)
+            await asyncio.to_thread(self._create_result_issue, event, str(final_output))
+        except asyncio.CancelledError:
+            # Nothing was posted for this content, so an identical later edit must run again.
+            if self._last_digest.get(key) == event.digest:
+                del self._last_digest[key]
+            raise
+        except Exception:
+            self._schedule_retry(event)
+            raise
+
+        # The package issue exists from here on, so the digest stays recorded even if
+        # labelling fails; otherwise the next poll would post a duplicate package.
+        self._failures.pop(key, None)
+        labelled = await asyncio.to_thread(
+            self.gitlab.add_labels_to_issue,
+            issue_iid=event.issue_iid,
+            labels_to_add_csv=self.processed_label,
+            project_path=event.project_path,
+        )
+        if labelled.startswith("ERROR:"):
+            logger.warning("add_labels_to_issue failed for %s#%s: %s", *key, labelled)
+
+        self._counters["runs_completed"] += 1
+        # Clamped: GitLab's clock may run slightly ahead of ours.
+        self._lag_seconds.append(max(0.0, time.time() - event.lag_origin))
+
+    def _create_result_issue(self, event: IssueEvent, final_output: str) -> None:
+        created = self.gitlab.create_issue(
+            title=f"Scrum package: {event.title} (#{event.issue_iid})",
+            description=f"Generated from #{event.issue_iid}.\n\n{final_output}",
+            project_path=event.project_path,
+            labels_csv=self.result_label,
+        )
+        if created.startswith("ERROR:"):
+            raise RuntimeError(f"create_issue failed for #{event.issue_iid}: {created}")
+
+    def _schedule_retry(self, event: IssueEvent) -> None:
+        # Retry a failed run with exponential backoff, up to max_attempts per content version.
+        key = event.key
+        digest, attempts = self._failures.get(key, (None, 0))
+        attempts = attempts + 1 if digest == event.digest else 1
+        self._failures[key] = (event.digest, attempts)
+        if attempts >= self.max_attempts:
+            # Keep the digest so re-polls of this content are ignored until the issue is edited.
+            logger.error("Giving up on %s#%s after %d failed runs", *key, attempts)
+            return
+
+        if self._last_digest.get(key) == event.digest:
+            del self._last_digest[key]
+        if key in self._pending:
+            return  # a newer edit will run anyway
+        event.window_start = time.monotonic()
+        self._pending[key] = event
+        delay = self.retry_backoff_seconds * 2 ** (attempts - 1)
+        self._timers[key] = self.loop.call_later(delay, self._on_debounced, key)
+
+    # ------------------------------------
+    # Lifecycle and metrics
+    # ------------------------------------
+    async def start(self, poll_interval_seconds: Optional[float] = None) -> None:
+        self.loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        self._tasks = [
+            asyncio.create_task(self._consume()) for _ in range(self.max_concurrent_runs)
+        ]
+        if poll_interval_seconds:
+            self._tasks.append(asyncio.create_task(self.poll_forever(poll_interval_seconds)))
+
+    async def stop(self) -> None:
+        for handle in self._timers.values():
+            handle.cancel()
+        self._timers.clear()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def metrics(self) -> Dict[str, Any]:
+        lags = self._lag_seconds
+        return {
+            **self._counters,
+            # Issues with an edit waiting to run (debouncing or queued).
+            "queue_depth": len(self._pending),
+            "queued": len(self._queued),
+            "in_flight": len(self._active),
+            # Lag stats cover the most recent lag_window completed runs.
+            "lag_last_seconds": lags[-1] if lags else None,
+            "lag_avg_seconds": sum(lags) / len(lags) if lags else None,
+            "lag_max_seconds": max(lags) if lags else None,
+        }
+
+
+# ------------------------------------
+# Webhook receiver
+# ------------------------------------
+def start_webhook_server(
+    worker: GitLabIssueWorker,
+    host: str = "127.0.0.1",
+    port: int = 8080,
+    secret_token: Optional[str] = None,
+) -> ThreadingHTTPServer:
+    """
+    Serve GitLab webhooks in a background thread and hand payloads to the worker's loop.
+    Binding to anything other than localhost requires a secret token.
+    """
+    if not secret_token and host not in ("127.0.0.1", "localhost", "::1"):
+        raise ValueError("secret_token is required when the webhook server is not bound to localhost.")
+
+    async def _read_metrics() -> Dict[str, Any]:
+        return worker.metrics()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            if secret_token and self.headers.get("X-Gitlab-Token") != secret_token:
+                self.send_response(401)
+                self.end_headers()
+                return
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                payload = json.loads(self.rfile.read(length) or b"{}")
+            except ValueError:
+                payload = None
+            if not isinstance(payload, dict):
+                self.send_response(400)
+                self.end_headers()
+                return
+
+            worker.loop.call_soon_threadsafe(worker.submit_webhook_payload, payload)
+            self.send_response(202)
+            self.end_headers()
+
+        def do_GET(self):
+            # Worker state belongs to the event loop; read it there rather than from this thread.
+            future = asyncio.run_coroutine_threadsafe(_read_metrics(), worker.loop)
+            body = json.dumps(future.result(timeout=10)).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logger.debug(format, *args)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# ------------------------------------
+# Program execution
+# Listens for GitLab issue webhooks and/or polls for updated issues.
+# ------------------------------------
+async def main():
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+
+    gitlab = GitLabPlugin(
+        base_url=os.getenv("GITLAB_URL", "https://gitlab.com"),
+        pat=os.getenv("GITLAB_PAT", ""),
+        default_project=os.getenv("GITLAB_PROJECT"),
+    )
+    worker = GitLabIssueWorker(
+        gitlab,
+        trigger_label=os.getenv("GITLAB_TRIGGER_LABEL", "requirement"),
+        debounce_seconds=float(os.getenv("SCRUM_DEBOUNCE_SECONDS", "20")),
+        max_delay_seconds=float(os.getenv("SCRUM_MAX_DELAY_SECONDS", "120")),
+    )
+
+    poll_interval = float(os.getenv("GITLAB_POLL_SECONDS", "0"))
+    await worker.start(poll_interval_seconds=poll_interval or None)
+
+    server = None
+    if os.getenv("GITLAB_WEBHOOK_PORT"):
+        server = start_webhook_server(
+            worker,
+            host=os.getenv("GITLAB_WEBHOOK_HOST", "127.0.0.1"),
+            port=int(os.getenv("GITLAB_WEBHOOK_PORT")),
+            secret_token=os.getenv("GITLAB_WEBHOOK_SECRET"),
+        )
+
+    try:
+        while True:
+            await asyncio.sleep(60)
+            logger.info("Worker metrics: %s", worker.metrics())
+    finally:
+        if server:
+            server.shutdown()
+        await worker.stop()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -39,11 +39,20 @@ async def run_scrum_team(task: str, message_callback=None):
     runtime = InProcessRuntime()
     runtime.start()
 
+    cancelled = False
     try:
         result = await orchestration.invoke(task=task, runtime=runtime)
         final_output = await result.get()
+    except asyncio.CancelledError:
+        cancelled = True
+        raise
     finally:
-        await runtime.stop_when_idle()
+        # A cancelled run (e.g. superseded by a newer issue edit) must not wait
+        # for the remaining agent turns to drain.
+        if cancelled:
+            await runtime.stop()
+        else:
+            await runtime.stop_when_idle()
 
     return final_output.content    
 
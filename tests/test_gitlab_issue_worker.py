@@ -0,0 +1,526 @@
+import asyncio
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+import pytest
+
+from plugins.gitlab_plugin import GitLabPlugin
+from runtime.gitlab_issue_worker import GitLabIssueWorker, start_webhook_server
+
+PROJECT = "group/project"
+
+
+# -----------------------------
+# Local stand-in for the GitLab issues API
+# -----------------------------
+class StandInGitLab:
+    def __init__(self):
+        self.issues = {}
+        self.created = []
+        self.list_params = []
+        self.fail_put = False
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _send(self, code, obj):
+                body = json.dumps(obj).encode("utf-8")
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _form(self):
+                length = int(self.headers.get("Content-Length", 0))
+                return {k: v[0] for k, v in parse_qs(self.rfile.read(length).decode()).items()}
+
+            def _route(self):
+                path = unquote(urlparse(self.path).path)
+                prefix = f"/api/v4/projects/{PROJECT}/issues"
+                if not path.startswith(prefix):
+                    return None, None
+                rest = path[len(prefix):].strip("/")
+                return True, int(rest) if rest else None
+
+            def do_GET(self):
+                ok, iid = self._route()
+                if not ok:
+                    return self._send(404, {"message": "404 Project Not Found"})
+                if iid is not None:
+                    return self._send(200, stand_in.issues[iid])
+                params = {k: v[0] for k, v in parse_qs(urlparse(self.path).query).items()}
+                stand_in.list_params.append(params)
+                issues = sorted(stand_in.issues.values(), key=lambda i: i["updated_at"])
+                if "updated_after" in params:
+                    # Inclusive, like GitLab.
+                    after = _ts(params["updated_after"])
+                    issues = [i for i in issues if _ts(i["updated_at"]) >= after]
+                if params.get("state", "all") != "all":
+                    issues = [i for i in issues if i["state"] == params["state"]]
+                per_page, page = int(params.get("per_page", 20)), int(params.get("page", 1))
+                self._send(200, issues[(page - 1) * per_page:page * per_page])
+
+            def do_POST(self):
+                ok, _ = self._route()
+                if not ok:
+                    return self._send(404, {"message": "404 Project Not Found"})
+                data = self._form()
+                stand_in.created.append(data)
+                self._send(201, {"iid": 1000 + len(stand_in.created), **data})
+
+            def do_PUT(self):
+                ok, iid = self._route()
+                if not ok:
+                    return self._send(404, {"message": "404 Project Not Found"})
+                if stand_in.fail_put:
+                    return self._send(500, {"message": "500 Internal Server Error"})
+                stand_in.issues[iid]["labels"] = self._form()["labels"].split(",")
+                self._send(200, stand_in.issues[iid])
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def add_issue(self, iid, description, labels=("requirement",), updated_at=None):
+        self.issues[iid] = {
+            "iid": iid,
+            "title": f"Requirement {iid}",
+            "description": description,
+            "labels": list(labels),
+            "state": "opened",
+            "updated_at": updated_at or _now(),
+        }
+
+
+class FakeRunner:
+    def __init__(self, seconds=0.05, fail=False):
+        self.seconds = seconds
+        self.fail = fail
+        self.tasks = []
+
+    async def __call__(self, task):
+        self.tasks.append(task)
+        await asyncio.sleep(self.seconds)
+        if self.fail:
+            raise RuntimeError("LLM unavailable")
+        return f"PACKAGE for {task}"
+
+
+def _ts(value):
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+def _now(offset_seconds=0.0):
+    t = datetime.now(timezone.utc) + timedelta(seconds=offset_seconds)
+    return t.strftime("%Y-%m-%dT%H:%M:%S.") + f"{t.microsecond // 1000:03d}Z"
+
+
+def _hook(iid, description, labels=("requirement",), project=PROJECT, action="update"):
+    return {
+        "object_kind": "issue",
+        "project": {"path_with_namespace": project},
+        "labels": [{"title": label} for label in labels],
+        "object_attributes": {
+            "iid": iid,
+            "title": f"Requirement {iid}",
+            "description": description,
+            "action": action,
+            "updated_at": _now(),
+        },
+    }
+
+
+async def _wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("condition not reached in time")
+        await asyncio.sleep(0.01)
+
+
+@pytest.fixture
+def gitlab():
+    stand_in = StandInGitLab()
+    yield stand_in
+    stand_in.server.shutdown()
+
+
+def _worker(gitlab, runner, **kwargs):
+    kwargs.setdefault("debounce_seconds", 0.1)
+    kwargs.setdefault("max_delay_seconds", 1.0)
+    plugin = GitLabPlugin(gitlab.url, "token", default_project=PROJECT)
+    return GitLabIssueWorker(plugin, runner=runner, **kwargs)
+
+
+# -----------------------------
+# Debounce / coalesce / cancel
+# -----------------------------
+def test_burst_of_edits_is_coalesced_into_one_run(gitlab):
+    gitlab.add_issue(1, "v0")
+    runner = FakeRunner()
+
+    async def scenario():
+        worker = _worker(gitlab, runner)
+        await worker.start()
+        for i in range(5):
+            worker.submit_webhook_payload(_hook(1, f"v{i + 1}"))
+            await asyncio.sleep(0.02)
+        await _wait_for(lambda: worker.metrics()["runs_completed"] == 1)
+        await asyncio.sleep(0.2)
+        await worker.stop()
+        return worker.metrics()
+
+    metrics = asyncio.run(scenario())
+    assert runner.tasks == ["Requirement 1\n\nv5"]
+    assert metrics["events_coalesced"] == 4
+    assert metrics["runs_started"] == 1
+    assert [c["title"] for c in gitlab.created] == ["Scrum package: Requirement 1 (#1)"]
+    assert gitlab.created[0]["labels"] == "scrum-ai-package"
+    assert "scrum-ai-processed" in gitlab.issues[1]["labels"]
+
+
+def test_newer_edit_cancels_stale_run(gitlab):
+    gitlab.add_issue(1, "v0")
+    runner = FakeRunner(seconds=0.5)
+
+    async def scenario():
+        worker = _worker(gitlab, runner)
+        await worker.start()
+        worker.submit_webhook_payload(_hook(1, "v1"))
+        # Wait for the runner itself to start, not just for the run to be dispatched.
+        await _wait_for(lambda: runner.tasks)
+        worker.submit_webhook_payload(_hook(1, "v2"))
+        await _wait_for(lambda: worker.metrics()["runs_completed"] == 1)
+        await worker.stop()
+        return worker.metrics()
+
+    metrics = asyncio.run(scenario())
+    assert runner.tasks == ["Requirement 1\n\nv1", "Requirement 1\n\nv2"]
+    assert metrics["runs_cancelled"] == 1
+    assert len(gitlab.created) == 1
+    assert "v2" in gitlab.created[0]["description"]
+
+
+def test_edits_during_long_run_are_still_debounced(gitlab):
+    # A run in flight for longer than max_delay_seconds must not make later edits bypass debouncing.
+    gitlab.add_issue(1, "v0")
+    runner = FakeRunner(seconds=1.0)
+
+    async def scenario():
+        worker = _worker(gitlab, runner, debounce_seconds=0.2, max_delay_seconds=0.4)
+        await worker.start()
+        worker.submit_webhook_payload(_hook(1, "v1"))
+        # Wait for the runner itself to start, not just for the run to be dispatched.
+        await _wait_for(lambda: runner.tasks)
+        await asyncio.sleep(0.6)
+        for i in range(5):
+            worker.submit_webhook_payload(_hook(1, f"edit {i}"))
+            await asyncio.sleep(0.05)
+        await _wait_for(lambda: worker.metrics()["runs_completed"] == 1)
+        await worker.stop()
+        return worker.metrics()
+
+    metrics = asyncio.run(scenario())
+    assert metrics["runs_started"] == 2
+    assert metrics["runs_cancelled"] == 1
+    assert metrics["events_coalesced"] == 4
+    assert runner.tasks[-1] == "Requirement 1\n\nedit 4"
+
+
+# -----------------------------
+# Filtering
+# -----------------------------
+def test_label_only_and_self_created_issues_are_ignored(gitlab):
+    gitlab.add_issue(1, "v0")
+    runner = FakeRunner()
+
+    async def scenario():
+        worker = _worker(gitlab, runner)
+        await worker.start()
+        worker.submit_webhook_payload(_hook(1, "v1"))
+        await _wait_for(lambda: worker.metrics()["runs_completed"] == 1)
+        # Echo of our own processed label, then the result issue we created.
+        worker.submit_webhook_payload(_hook(1, "v1", labels=("requirement", "scrum-ai-processed")))
+        worker.submit_webhook_payload(_hook(1001, "package", labels=("requirement", "scrum-ai-package")))
+        await asyncio.sleep(0.3)
+        await worker.stop()
+        return worker.metrics()
+
+    metrics = asyncio.run(scenario())
+    assert metrics["runs_started"] == 1
+    assert metrics["events_ignored"] == 2
+    assert metrics["queue_depth"] == 0
+
+
+def test_issues_without_trigger_label_or_from_other_projects_are_ignored(gitlab):
+    runner = FakeRunner()
+
+    async def scenario():
+        worker = _worker(gitlab, runner)
+        await worker.start()
+        worker.submit_webhook_payload(_hook(1, "a bug", labels=("bug",)))
+        worker.submit_webhook_payload(_hook(2, "v1", project="someone/else"))
+        worker.submit_webhook_payload({"object_kind": "issue", "object_attributes": {"iid": 3}})
+        await asyncio.sleep(0.3)
+        await worker.stop()
+        return worker.metrics()
+
+    metrics = asyncio.run(scenario())
+    assert runner.tasks == []
+    assert gitlab.created == []
+    assert metrics["queue_depth"] == 0
+
+
+def test_removing_trigger_label_withdraws_pending_edit(gitlab):
+    runner = FakeRunner()
+
+    async def scenario():
+        worker = _worker(gitlab, runner, debounce_seconds=0.2)
+        await worker.start()
+        worker.submit_webhook_payload(_hook(1, "v1"))
+        worker.submit_webhook_payload(_hook(1, "v1", labels=()))
+        await asyncio.sleep(0.4)
+        await worker.stop()
+        return worker.metrics()
+
+    metrics = asyncio.run(scenario())
+    assert runner.tasks == []
+    assert metrics["queue_depth"] == 0
+
+
+# -----------------------------
+# Failures
+# -----------------------------
+def test_labelling_failure_does_not_repost_package(gitlab):
+    gitlab.add_issue(1, "v1", updated_at=_now(-5))
+    gitlab.fail_put = True
+    runner = FakeRunner()
+
+    async def scenario():
+        worker = _worker(gitlab, runner, updated_after=_now(-60))
+        await worker.start()
+        await worker.poll_once()
+        await _wait_for(lambda: worker.metrics()["runs_completed"] == 1)
+        # The issue is still at the inclusive cursor and was not labelled.
+        for _ in range(3):
+            await worker.poll_once()
+        await asyncio.sleep(0.3)
+        await worker.stop()
+        return worker.metrics()
+
+    metrics = asyncio.run(scenario())
+    assert len(runner.tasks) == 1
+    assert len(gitlab.created) == 1
+    assert metrics["runs_started"] == 1
+    assert "scrum-ai-processed" not in gitlab.issues[1]["labels"]
+
+
+def test_failed_runs_are_retried_up_to_max_attempts(gitlab):
+    gitlab.add_issue(1, "v1", updated_at=_now(-5))
+    runner = FakeRunner(fail=True)
+
+    async def scenario():
+        worker = _worker(gitlab, runner, updated_after=_now(-60), max_attempts=3, retry_backoff_seconds=0.05)
+        await worker.start()
+        await worker.poll_once()
+        await _wait_for(lambda: worker.metrics()["runs_failed"] == 3)
+        # Given up: neither re-polls nor re-deliveries of the same content start another run.
+        await worker.poll_once()
+        worker.submit_webhook_payload(_hook(1, "v1"))
+        await asyncio.sleep(0.4)
+        await worker.stop()
+        return worker.metrics()
+
+    metrics = asyncio.run(scenario())
+    assert metrics["runs_started"] == 3
+    assert metrics["queue_depth"] == 0
+    assert gitlab.created == []
+
+
+# -----------------------------
+# Polling
+# -----------------------------
+def test_poll_advances_updated_after_cursor(gitlab):
+    start = _now(-60)
+    gitlab.add_issue(1, "v1", updated_at=_now(-30))
+    gitlab.add_issue(2, "v1", updated_at=_now(-20))
+    gitlab.add_issue(3, "old", updated_at=_now(-120))
+    runner = FakeRunner()
+
+    async def scenario():
+        worker = _worker(gitlab, runner, debounce_seconds=0.2, updated_after=start)
+        await worker.start()
+        assert await worker.poll_once() == 2
+        assert worker.updated_after == gitlab.issues[2]["updated_at"]
+        cursor = worker.updated_after
+
+        # The issue at the cursor comes back (inclusive boundary) but is not resubmitted.
+        received = worker.metrics()["events_received"]
+        assert await worker.poll_once() == 1
+        assert worker.metrics()["events_received"] == received
+        assert worker.metrics()["events_coalesced"] == 0
+
+        await _wait_for(lambda: worker.metrics()["runs_completed"] == 2)
+        # Posting results bumps updated_at on the issues; label-only changes do not rerun.
+        for iid in (1, 2):
+            gitlab.issues[iid]["updated_at"] = _now()
+        await worker.poll_once()
+        await asyncio.sleep(0.3)
+        await worker.stop()
+        return cursor, worker.metrics()
+
+    cursor, metrics = asyncio.run(scenario())
+    assert gitlab.list_params[0]["updated_after"] == start
+    assert gitlab.list_params[1]["updated_after"] == cursor
+    assert sorted(runner.tasks) == ["Requirement 1\n\nv1", "Requirement 2\n\nv1"]
+    assert metrics["runs_started"] == 2
+
+
+def test_poll_discards_pending_edit_when_issue_is_closed(gitlab):
+    gitlab.add_issue(1, "v1", updated_at=_now(-5))
+    runner = FakeRunner()
+
+    async def scenario():
+        worker = _worker(gitlab, runner, debounce_seconds=0.3, updated_after=_now(-60))
+        await worker.start()
+        await worker.poll_once()
+        assert worker.metrics()["queue_depth"] == 1
+        gitlab.issues[1].update(state="closed", updated_at=_now())
+        await worker.poll_once()
+        await asyncio.sleep(0.5)
+        await worker.stop()
+        return worker.metrics()
+
+    metrics = asyncio.run(scenario())
+    assert gitlab.list_params[0]["state"] == "all"
+    assert runner.tasks == []
+    assert metrics["queue_depth"] == 0
+
+
+def test_poll_reads_every_page_of_issues_sharing_updated_at(gitlab):
+    same_time = _now(-5)
+    for iid in range(1, 6):
+        gitlab.add_issue(iid, "v1", updated_at=same_time)
+    runner = FakeRunner(seconds=0.01)
+
+    async def scenario():
+        worker = _worker(gitlab, runner, updated_after=same_time)
+        await worker.start()
+        fetched = await worker.poll_once(per_page=2)
+        await _wait_for(lambda: worker.metrics()["runs_completed"] == 5)
+        await worker.stop()
+        return fetched
+
+    assert asyncio.run(scenario()) == 5
+    assert [p["page"] for p in gitlab.list_params] == ["1", "2", "3"]
+    assert len(runner.tasks) == 5
+
+
+def test_lag_is_measured_from_issue_updated_at_over_recent_runs(gitlab):
+    gitlab.add_issue(1, "v1", updated_at=_now(-30))
+    gitlab.add_issue(2, "v1", updated_at=_now(-6))
+    gitlab.add_issue(3, "v1", updated_at=_now(-5))
+    runner = FakeRunner()
+
+    async def scenario():
+        worker = _worker(gitlab, runner, updated_after=_now(-60), lag_window=2)
+        await worker.start()
+        await worker.poll_once()
+        await _wait_for(lambda: worker.metrics()["runs_completed"] == 1)
+        first = worker.metrics()
+        await _wait_for(lambda: worker.metrics()["runs_completed"] == 3)
+        await worker.stop()
+        return first, worker.metrics()
+
+    first, metrics = asyncio.run(scenario())
+    assert runner.tasks[0] == "Requirement 1\n\nv1"
+    assert first["lag_max_seconds"] >= 30
+    # Only the two most recent runs (issues 2 and 3) are left in the lag window.
+    assert 5 <= metrics["lag_avg_seconds"] < 20
+    assert 5 <= metrics["lag_max_seconds"] < 20
+
+
+# -----------------------------
+# Webhook receiver
+# -----------------------------
+def test_webhook_server_validates_requests(gitlab):
+    gitlab.add_issue(1, "v0")
+    runner = FakeRunner()
+
+    def post(port, body, token="secret"):
+        request = urllib.request.Request(
+            f"http://127.0.0.1:{port}/", data=body, headers={"X-Gitlab-Token": token}
+        )
+        try:
+            return urllib.request.urlopen(request).status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+    async def scenario():
+        worker = _worker(gitlab, runner)
+        await worker.start()
+        server = start_webhook_server(worker, port=0, secret_token="secret")
+        port = server.server_port
+        try:
+            statuses = await asyncio.to_thread(lambda: [
+                post(port, json.dumps(_hook(1, "v1")).encode(), token="wrong"),
+                post(port, b"[1, 2]"),
+                post(port, b"not json"),
+                post(port, json.dumps(_hook(1, "v1")).encode()),
+            ])
+            await _wait_for(lambda: worker.metrics()["runs_completed"] == 1)
+            metrics = await asyncio.to_thread(
+                lambda: json.loads(urllib.request.urlopen(f"http://127.0.0.1:{port}/").read())
+            )
+        finally:
+            server.shutdown()
+            await worker.stop()
+        return statuses, metrics
+
+    statuses, metrics = asyncio.run(scenario())
+    assert statuses == [401, 400, 400, 202]
+    assert metrics["runs_completed"] == 1
+
+
+def test_webhook_payload_with_gitlab_utc_timestamp_is_processed(gitlab):
+    gitlab.add_issue(1, "v0")
+    runner = FakeRunner()
+    ten_seconds_ago = (datetime.now(timezone.utc) - timedelta(seconds=10)).strftime("%Y-%m-%d %H:%M:%S UTC")
+
+    async def scenario():
+        worker = _worker(gitlab, runner)
+        await worker.start()
+        server = start_webhook_server(worker, port=0)
+        url = f"http://127.0.0.1:{server.server_port}/"
+        try:
+            hook = _hook(1, "v1")
+            hook["object_attributes"]["updated_at"] = ten_seconds_ago
+            bad_iid = _hook(2, "v1")
+            bad_iid["object_attributes"]["iid"] = "not-a-number"
+            for payload in (bad_iid, hook):
+                request = urllib.request.Request(url, data=json.dumps(payload).encode())
+                await asyncio.to_thread(urllib.request.urlopen, request)
+            await _wait_for(lambda: worker.metrics()["runs_completed"] == 1)
+        finally:
+            server.shutdown()
+            await worker.stop()
+        return worker.metrics()
+
+    metrics = asyncio.run(scenario())
+    assert runner.tasks == ["Requirement 1\n\nv1"]
+    assert metrics["lag_last_seconds"] >= 9
+
+
+def test_webhook_server_requires_secret_off_localhost(gitlab):
+    worker = _worker(gitlab, FakeRunner())
+    with pytest.raises(ValueError):
+        start_webhook_server(worker, host="0.0.0.0", port=0)